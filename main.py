@@ -2,18 +2,38 @@
 VIN Parser для emex.ru
 Парсер для получения информации о запчастях по VIN коду автомобиля
 """
+# gevent должен пропатчить сокеты и потоки до импорта requests/urllib3
+try:
+    import gevent
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    print("Установите необходимые зависимости: pip install -r requirements.txt")
+    exit(1)
+
 import os
-import json
+import re
+import codecs
+import functools
+import threading
+import concurrent.futures
 import time
 import logging
 from typing import Dict, List, Optional
 from datetime import datetime
 
 try:
+    import orjson
     import requests
-    from bs4 import BeautifulSoup
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    import lxml.html
+    from lxml import etree
     from flask import Flask, request, jsonify
+    from flask.json.provider import JSONProvider
     from flask_cors import CORS
+    from werkzeug.exceptions import HTTPException
+    import redis
 except ImportError:
     print("Установите необходимые зависимости: pip install -r requirements.txt")
     exit(1)
@@ -25,12 +45,267 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class ORJSONProvider(JSONProvider):
+    """JSON-провайдер Flask на базе orjson для jsonify и request.get_json"""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
+@functools.lru_cache(maxsize=32)
+def _html_parser(encoding: Optional[str]) -> lxml.html.HTMLParser:
+    """Общий парсер HTML для кодировки, пропускающий комментарии, PI и пробельный текст"""
+    return lxml.html.HTMLParser(encoding=encoding, remove_comments=True, remove_pis=True,
+                                remove_blank_text=True)
+
+
+# <meta charset> по стандарту HTML должен находиться в первых 1024 байтах
+_ENCODING_SNIFF_BYTES = 1024
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset', re.IGNORECASE)
+
+
+def _is_utf8(data: bytes) -> bool:
+    """Проверка, что фрагмент (возможно, обрезанный посреди символа) является UTF-8"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _parse_html(response: requests.Response):
+    """Дерево HTML-страницы из ответа в кодировке, указанной сервером; None для пустой страницы"""
+    # Кодировку из Content-Type передаем парсеру; иначе libxml2 сам читает <meta charset>.
+    # Если нет ни того, ни другого, libxml2 читает страницу как Latin-1, поэтому
+    # проверяем начало страницы на UTF-8
+    encoding = None
+    if 'charset' in response.headers.get('Content-Type', '').lower():
+        encoding = response.encoding
+    else:
+        prefix = response.content[:_ENCODING_SNIFF_BYTES]
+        if not _META_CHARSET_RE.search(prefix) and _is_utf8(prefix):
+            encoding = 'utf-8'
+    return etree.fromstring(response.content, _html_parser(encoding))
+
+
+# VIN: 17 символов, латинские буквы (кроме I, O, Q) и цифры
+_VIN_RE = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$')
+INVALID_VIN_MESSAGE = 'Неверный формат VIN кода. Должно быть 17 символов: латинские буквы (кроме I, O, Q) и цифры.'
+
+# Таймауты (соединение, чтение): недоступный хост отсекается за секунды,
+# а не держит рабочий поток до истечения полного таймаута чтения
+EMEX_TIMEOUT = (5, 30)
+NHTSA_TIMEOUT = (5, 10)
+
+# Redis-кэш ответов API (опционально: включается переменной REDIS_URL)
+REDIS_URL = os.getenv('REDIS_URL')
+CACHE_TTL_SEARCH = int(os.getenv('CACHE_TTL_SEARCH', 300))
+CACHE_TTL_DETAILS = int(os.getenv('CACHE_TTL_DETAILS', 900))
+redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=1) if REDIS_URL else None
+
+
+def cached(prefix: str, ttl: int):
+    """Декоратор: кэширует успешные результаты метода парсера в Redis на ttl секунд"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if redis_client is None:
+                return method(self, *args, **kwargs)
+            
+            # JSON различает None и строку 'None', в отличие от str(); аккаунт входит в ключ,
+            # чтобы после смены пользователя не отдавать результаты, полученные под другим
+            account = self.username if self.is_authenticated else None
+            key = f"{prefix}:{orjson.dumps([account, args, sorted(kwargs.items())]).decode()}"
+            
+            try:
+                hit = redis_client.get(key)
+                if hit is not None:
+                    return orjson.loads(hit)
+            except redis.RedisError as e:
+                logger.warning(f"Ошибка чтения из Redis: {str(e)}")
+            except orjson.JSONDecodeError:
+                logger.warning(f"Поврежденное значение в Redis по ключу {key}, считаем промахом")
+            
+            result = method(self, *args, **kwargs)
+            
+            if 'error' not in result:
+                try:
+                    redis_client.setex(key, ttl, orjson.dumps(result))
+                except redis.RedisError as e:
+                    logger.warning(f"Ошибка записи в Redis: {str(e)}")
+            
+            return result
+        return wrapper
+    return decorator
+
+
+def _mount_adapter(session: requests.Session) -> None:
+    """Пул соединений под конкурентную нагрузку и повтор при временных ошибках шлюза"""
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        # Повторяем только ответы 502/503/504: таймауты соединения и чтения не повторяются,
+        # чтобы зависший хост не умножал время запроса, а Retry-After не удерживает запрос
+        max_retries=Retry(total=2, connect=0, read=0, backoff_factor=0.2,
+                          status_forcelist=[502, 503, 504], raise_on_status=False,
+                          respect_retry_after_header=False)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+# Выполняющиеся сейчас вызовы: ключ аргументов -> Future с результатом
+_INFLIGHT: Dict[tuple, concurrent.futures.Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def single_flight(method):
+    """Декоратор: одновременные вызовы метода с одинаковыми аргументами выполняются один раз,
+    остальные вызывающие ждут результат первого"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        account = self.username if self.is_authenticated else None
+        key = (method.__name__, account, args, tuple(sorted(kwargs.items())))
+        
+        with _INFLIGHT_LOCK:
+            future = _INFLIGHT.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = concurrent.futures.Future()
+                _INFLIGHT[key] = future
+        
+        if not is_leader:
+            return future.result()
+        
+        try:
+            result = method(self, *args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with _INFLIGHT_LOCK:
+                _INFLIGHT.pop(key, None)
+    return wrapper
+
+
+# Сессия для публичного NHTSA API, общая для всех экземпляров парсера,
+# чтобы TLS-соединения переиспользовались между запросами
+_NHTSA_SESSION = requests.Session()
+_mount_adapter(_NHTSA_SESSION)
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_vin_cached(vin_code: str) -> bytes:
+    """Запрос к NHTSA API с кэшированием неизменяемого JSON vehicle_info (ошибки не кэшируются)"""
+    nhtsa_url = f"https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVin/{vin_code}?format=json"
+    response = _NHTSA_SESSION.get(nhtsa_url, timeout=NHTSA_TIMEOUT)
+    
+    if response.status_code != 200:
+        raise requests.HTTPError(f"NHTSA API: {response.status_code}", response=response)
+    
+    # orjson разбирает байты ответа напрямую, без промежуточного декодирования в str
+    results = orjson.loads(response.content).get('Results', [])
+    # Записи без имени переменной пропускаем: orjson допускает только строковые ключи
+    vehicle_info = {variable: value for item in results
+                    if (variable := item.get('Variable')) and (value := item.get('Value'))}
+    
+    return orjson.dumps(vehicle_info)
+
+
+def _has_class(name: str) -> str:
+    """XPath-условие: у элемента есть CSS-класс name"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _descendant_xpath(condition: str) -> etree.XPath:
+    """Скомпилированный XPath первого потомка, удовлетворяющего условию"""
+    return etree.XPath(f"descendant::*[{condition}][1]")
+
+
+def _find(element, xpaths):
+    """Первый потомок элемента по скомпилированным XPath (проверяются по порядку)"""
+    for xpath in xpaths:
+        found = xpath(element)
+        if found:
+            return found[0]
+    return None
+
+
+# Таблица повторяющихся значений полей (наличие, бренды, сроки) с ограниченным размером:
+# одинаковые строки в ответах разделяют один объект вместо новой аллокации на каждую запчасть
+_VALUE_INTERN: Dict[str, str] = {}
+_VALUE_INTERN_MAX = 4096
+
+
+def _intern(text: str) -> str:
+    """Возвращает ранее сохраненный экземпляр строки, если он есть"""
+    interned = _VALUE_INTERN.get(text)
+    if interned is not None:
+        return interned
+    if len(_VALUE_INTERN) < _VALUE_INTERN_MAX:
+        _VALUE_INTERN[text] = text
+    return text
+
+
+def _text(element) -> str:
+    """Текст элемента без пробелов по краям каждого фрагмента"""
+    return ''.join(chunk.strip() for chunk in element.itertext())
+
+
 class EmexVINParser:
     """Класс для парсинга данных о запчастях с emex.ru по VIN коду"""
     
+    # Все варианты разметки списка запчастей ищутся за один обход дерева;
+    # строки, вложенные в другую найденную строку, не считаются отдельными запчастями
+    _PART_ITEM_CONDITION = (
+        f"(self::div and ({_has_class('part-item')} or @data-type='part'))"
+        f" or (self::tr and {_has_class('search-row')})"
+    )
+    _PART_ITEMS_XPATH = etree.XPath(
+        f"//*[{_PART_ITEM_CONDITION}][not(ancestor::*[{_PART_ITEM_CONDITION}])]"
+    )
+    _OFFER_ITEMS_XPATHS = (
+        etree.XPath(f"//div[{_has_class('offer-item')}]"),
+        etree.XPath(f"//tr[{_has_class('offer-row')}]"),
+    )
+    
+    # Поле запчасти -> скомпилированные XPath: основной селектор и запасной
+    _PART_FIELD_XPATHS = {
+        'article': (_descendant_xpath(_has_class('article')),
+                    _descendant_xpath("self::td and @data-title='Артикул'")),
+        'name': (_descendant_xpath(_has_class('name')),
+                 _descendant_xpath(_has_class('part-name'))),
+        'price': (_descendant_xpath(_has_class('price')),
+                  _descendant_xpath("self::td and @data-title='Цена'")),
+        'availability': (_descendant_xpath(_has_class('availability')),
+                         _descendant_xpath("self::td and @data-title='Наличие'")),
+        'manufacturer': (_descendant_xpath(_has_class('manufacturer')),
+                         _descendant_xpath(_has_class('brand'))),
+        'delivery_time': (_descendant_xpath(_has_class('delivery')),
+                          _descendant_xpath("self::td and @data-title='Срок'")),
+    }
+    
+    # Поля с небольшим словарем значений, которые интернируются
+    _INTERNED_FIELDS = frozenset({'availability', 'manufacturer', 'delivery_time', 'warehouse'})
+    
+    # Поле предложения -> скомпилированные XPath
+    _OFFER_FIELD_XPATHS = {
+        'price': (_descendant_xpath(_has_class('price')),),
+        'availability': (_descendant_xpath(_has_class('availability')),),
+        'warehouse': (_descendant_xpath(_has_class('warehouse')),),
+        'delivery_time': (_descendant_xpath(_has_class('delivery')),),
+    }
+    
     def __init__(self, username: Optional[str] = None, password: Optional[str] = None):
         self.base_url = "https://emex.ru"
         self.session = requests.Session()
@@ -43,9 +318,11 @@ class EmexVINParser:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, br',
             'Connection': 'keep-alive',
         })
+        
+        # Пул соединений к emex.ru под реальную конкурентность запросов
+        _mount_adapter(self.session)
     
     def authenticate(self) -> bool:
         """Аутентификация на сайте emex.ru"""
@@ -60,7 +337,7 @@ class EmexVINParser:
                 'password': self.password
             }
             
-            response = self.session.post(login_url, data=login_data, timeout=30)
+            response = self.session.post(login_url, data=login_data, timeout=EMEX_TIMEOUT)
             
             if response.status_code == 200:
                 self.is_authenticated = True
@@ -78,36 +355,27 @@ class EmexVINParser:
         """Декодирование VIN кода для получения информации об автомобиле"""
         try:
             # Валидация VIN кода
-            if not vin_code or len(vin_code) != 17:
+            vin_code = (vin_code or '').upper()
+            if not _VIN_RE.match(vin_code):
                 return {
-                    'error': 'Неверный формат VIN кода. Должно быть 17 символов.',
+                    'error': INVALID_VIN_MESSAGE,
                     'vin': vin_code
                 }
             
             # Используем публичный API для декодирования VIN
-            nhtsa_url = f"https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVin/{vin_code}?format=json"
-            response = requests.get(nhtsa_url, timeout=10)
+            vehicle_info = orjson.loads(_decode_vin_cached(vin_code))
             
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get('Results', [])
-                
-                vehicle_info = {}
-                for item in results:
-                    if item.get('Value'):
-                        vehicle_info[item.get('Variable')] = item.get('Value')
-                
-                return {
-                    'vin': vin_code,
-                    'vehicle_info': vehicle_info,
-                    'decoded': True
-                }
-            else:
-                return {
-                    'error': 'Не удалось декодировать VIN',
-                    'vin': vin_code
-                }
+            return {
+                'vin': vin_code,
+                'vehicle_info': vehicle_info,
+                'decoded': True
+            }
                 
+        except requests.HTTPError:
+            return {
+                'error': 'Не удалось декодировать VIN',
+                'vin': vin_code
+            }
         except Exception as e:
             logger.error(f"Ошибка при декодировании VIN: {str(e)}")
             return {
@@ -115,22 +383,50 @@ class EmexVINParser:
                 'vin': vin_code
             }
     
-    def search_parts_by_vin(self, vin_code: str, part_name: Optional[str] = None) -> Dict:
-        """Поиск запчастей по VIN коду на emex.ru"""
+    def search_parts_by_vin(self, vin_code: str, part_name: Optional[str] = None,
+                            include_vehicle_info: bool = False) -> Dict:
+        """Поиск запчастей по VIN коду на emex.ru
+        
+        Данные об автомобиле (декодирование VIN через NHTSA) запрашиваются
+        только при include_vehicle_info=True.
+        """
+        # Невалидный VIN отсекаем до кэша и любых сетевых запросов, а валидный
+        # приводим к верхнему регистру, чтобы ключи кэша не зависели от регистра
+        vin_code = (vin_code or '').upper()
+        if not _VIN_RE.match(vin_code):
+            return {
+                'error': INVALID_VIN_MESSAGE,
+                'vin': vin_code
+            }
+        
+        return self._search_parts(vin_code, part_name, include_vehicle_info)
+    
+    # single_flight снаружи кэша: чтение и запись в Redis выполняет только первый вызов,
+    # остальные одновременные вызовы получают его результат
+    @single_flight
+    @cached('search', CACHE_TTL_SEARCH)
+    def _search_parts(self, vin_code: str, part_name: Optional[str], include_vehicle_info: bool) -> Dict:
+        """Поиск запчастей на emex.ru по уже проверенному VIN коду"""
         try:
-            # Сначала декодируем VIN
-            vin_info = self.decode_vin(vin_code)
-            
-            if 'error' in vin_info:
-                return vin_info
-            
             # Формируем URL для поиска на emex.ru
             search_url = f"{self.base_url}/search/vin/{vin_code}"
             
             if part_name:
                 search_url += f"?query={part_name}"
             
-            response = self.session.get(search_url, timeout=30)
+            if include_vehicle_info:
+                # Запрос к emex.ru не зависит от декодирования VIN, поэтому выполняется
+                # параллельно с ним в отдельном гринлете (без ограничения пулом потоков)
+                html_greenlet = gevent.spawn(self.session.get, search_url, timeout=EMEX_TIMEOUT)
+                vin_info = self.decode_vin(vin_code)
+                
+                if 'error' in vin_info:
+                    html_greenlet.kill(block=False)
+                    return vin_info
+                
+                response = html_greenlet.get()
+            else:
+                response = self.session.get(search_url, timeout=EMEX_TIMEOUT)
             
             if response.status_code != 200:
                 return {
@@ -139,17 +435,21 @@ class EmexVINParser:
                 }
             
             # Парсим HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-            parts = self._parse_parts_from_html(soup)
+            tree = _parse_html(response)
+            parts = self._parse_parts_from_html(tree)
             
-            return {
+            result = {
                 'vin': vin_code,
-                'vehicle_info': vin_info.get('vehicle_info', {}),
                 'parts': parts,
                 'total_parts': len(parts),
                 'timestamp': datetime.now().isoformat()
             }
             
+            if include_vehicle_info:
+                result['vehicle_info'] = vin_info.get('vehicle_info', {})
+            
+            return result
+            
         except Exception as e:
             logger.error(f"Ошибка при поиске запчастей: {str(e)}")
             return {
@@ -157,7 +457,7 @@ class EmexVINParser:
                 'vin': vin_code
             }
     
-    def _parse_parts_from_html(self, soup: BeautifulSoup) -> List[Dict]:
+    def _parse_parts_from_html(self, tree: Optional[lxml.html.HtmlElement]) -> List[Dict]:
         """Извлечение данных о запчастях из HTML"""
         parts = []
         
@@ -165,9 +465,8 @@ class EmexVINParser:
             # Ищем элементы с информацией о запчастях
             # Примечание: Структура сайта может меняться, нужно адаптировать селекторы
             
-            part_items = soup.find_all('div', class_='part-item') or \
-                        soup.find_all('tr', class_='search-row') or \
-                        soup.find_all('div', {'data-type': 'part'})
+            # Пустая страница (etree.fromstring вернул None) - запчастей нет
+            part_items = self._PART_ITEMS_XPATH(tree) if tree is not None else []
             
             for item in part_items:
                 part_data = self._extract_part_info(item)
@@ -187,36 +486,11 @@ class EmexVINParser:
         try:
             part_info = {}
             
-            # Артикул
-            article = element.find(class_='article') or element.find('td', {'data-title': 'Артикул'})
-            if article:
-                part_info['article'] = article.get_text(strip=True)
-            
-            # Название
-            name = element.find(class_='name') or element.find(class_='part-name')
-            if name:
-                part_info['name'] = name.get_text(strip=True)
-            
-            # Цена
-            price = element.find(class_='price') or element.find('td', {'data-title': 'Цена'})
-            if price:
-                price_text = price.get_text(strip=True)
-                part_info['price'] = price_text
-            
-            # Наличие
-            availability = element.find(class_='availability') or element.find('td', {'data-title': 'Наличие'})
-            if availability:
-                part_info['availability'] = availability.get_text(strip=True)
-            
-            # Производитель
-            manufacturer = element.find(class_='manufacturer') or element.find(class_='brand')
-            if manufacturer:
-                part_info['manufacturer'] = manufacturer.get_text(strip=True)
-            
-            # Срок доставки
-            delivery = element.find(class_='delivery') or element.find('td', {'data-title': 'Срок'})
-            if delivery:
-                part_info['delivery_time'] = delivery.get_text(strip=True)
+            for field, xpaths in self._PART_FIELD_XPATHS.items():
+                node = _find(element, xpaths)
+                if node is not None:
+                    text = _text(node)
+                    part_info[field] = _intern(text) if field in self._INTERNED_FIELDS else text
             
             return part_info if part_info else None
             
@@ -224,11 +498,12 @@ class EmexVINParser:
             logger.error(f"Ошибка при извлечении информации о запчасти: {str(e)}")
             return None
     
+    @cached('details', CACHE_TTL_DETAILS)
     def get_part_details(self, article: str) -> Dict:
         """Получение детальной информации о запчасти по артикулу"""
         try:
             search_url = f"{self.base_url}/search/articles/{article}"
-            response = self.session.get(search_url, timeout=30)
+            response = self.session.get(search_url, timeout=EMEX_TIMEOUT)
             
             if response.status_code != 200:
                 return {
@@ -236,8 +511,8 @@ class EmexVINParser:
                     'article': article
                 }
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            details = self._parse_part_details(soup, article)
+            tree = _parse_html(response)
+            details = self._parse_part_details(tree, article)
             
             return details
             
@@ -248,7 +523,7 @@ class EmexVINParser:
                 'article': article
             }
     
-    def _parse_part_details(self, soup: BeautifulSoup, article: str) -> Dict:
+    def _parse_part_details(self, tree: Optional[lxml.html.HtmlElement], article: str) -> Dict:
         """Парсинг детальной информации о запчасти"""
         details = {
             'article': article,
@@ -256,8 +531,11 @@ class EmexVINParser:
         }
         
         try:
-            offers = soup.find_all('div', class_='offer-item') or \
-                    soup.find_all('tr', class_='offer-row')
+            # Пустая страница (etree.fromstring вернул None) - предложений нет
+            if tree is None:
+                return details
+            
+            offers = self._OFFER_ITEMS_XPATHS[0](tree) or self._OFFER_ITEMS_XPATHS[1](tree)
             
             for offer in offers:
                 offer_data = {
@@ -268,21 +546,11 @@ class EmexVINParser:
                 }
                 
                 # Извлекаем данные предложения
-                price = offer.find(class_='price')
-                if price:
-                    offer_data['price'] = price.get_text(strip=True)
-                
-                availability = offer.find(class_='availability')
-                if availability:
-                    offer_data['availability'] = availability.get_text(strip=True)
-                
-                warehouse = offer.find(class_='warehouse')
-                if warehouse:
-                    offer_data['warehouse'] = warehouse.get_text(strip=True)
-                
-                delivery = offer.find(class_='delivery')
-                if delivery:
-                    offer_data['delivery_time'] = delivery.get_text(strip=True)
+                for field, xpaths in self._OFFER_FIELD_XPATHS.items():
+                    node = _find(offer, xpaths)
+                    if node is not None:
+                        text = _text(node)
+                        offer_data[field] = _intern(text) if field in self._INTERNED_FIELDS else text
                 
                 if any(offer_data.values()):
                     details['offers'].append(offer_data)
@@ -304,7 +572,7 @@ def home():
         'version': '1.0.0',
         'endpoints': {
             '/api/decode-vin/<vin>': 'Декодирование VIN кода',
-            '/api/search-parts/<vin>': 'Поиск запчастей по VIN',
+            '/api/search-parts/<vin>': 'Поиск запчастей по VIN (?vehicle_info=1 - добавить данные об автомобиле)',
             '/api/part-details/<article>': 'Детальная информация о запчасти',
             '/health': 'Проверка состояния сервиса'
         },
@@ -322,53 +590,63 @@ def health_check():
 @app.route('/api/decode-vin/<vin>', methods=['GET'])
 def decode_vin(vin):
     """Декодирование VIN кода"""
-    try:
-        result = parser.decode_vin(vin.upper())
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    vin = vin.upper()
+    if not _VIN_RE.match(vin):
+        return jsonify({'error': INVALID_VIN_MESSAGE, 'vin': vin}), 400
+    
+    return jsonify(parser.decode_vin(vin))
 
 @app.route('/api/search-parts/<vin>', methods=['GET'])
 def search_parts(vin):
     """Поиск запчастей по VIN коду"""
-    try:
-        part_name = request.args.get('part_name')
-        result = parser.search_parts_by_vin(vin.upper(), part_name)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    vin = vin.upper()
+    if not _VIN_RE.match(vin):
+        return jsonify({'error': INVALID_VIN_MESSAGE, 'vin': vin}), 400
+    
+    part_name = request.args.get('part_name')
+    include_vehicle_info = request.args.get('vehicle_info') == '1'
+    return jsonify(parser.search_parts_by_vin(vin, part_name, include_vehicle_info))
 
 @app.route('/api/part-details/<article>', methods=['GET'])
 def part_details(article):
     """Получение детальной информации о запчасти"""
-    try:
-        result = parser.get_part_details(article)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return jsonify(parser.get_part_details(article))
 
 @app.route('/api/authenticate', methods=['POST'])
 def authenticate():
     """Аутентификация на emex.ru"""
-    try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        
-        if not username or not password:
-            return jsonify({'error': 'Username и password обязательны'}), 400
-        
-        global parser
-        parser = EmexVINParser(username, password)
-        success = parser.authenticate()
-        
-        return jsonify({
-            'authenticated': success,
-            'message': 'Успешная аутентификация' if success else 'Ошибка аутентификации'
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Ожидается JSON-объект с username и password'}), 400
+    
+    username = data.get('username')
+    password = data.get('password')
+    
+    if not username or not password:
+        return jsonify({'error': 'Username и password обязательны'}), 400
+    
+    # Обновляем учетные данные на месте, чтобы не терять пул соединений сессии;
+    # cookies предыдущего пользователя сбрасываем, чтобы неудачный вход не оставил его сессию
+    parser.username = username
+    parser.password = password
+    parser.is_authenticated = False
+    parser.session.cookies.clear()
+    success = parser.authenticate()
+    
+    return jsonify({
+        'authenticated': success,
+        'message': 'Успешная аутентификация' if success else 'Ошибка аутентификации'
+    })
 
+@app.errorhandler(Exception)
+def handle_exception(e):
+    """Единый обработчик непредвиденных ошибок для всех маршрутов"""
+    # HTTP-ошибки (404, 405 и т.п.) отдаем как есть
+    if isinstance(e, HTTPException):
+        return e
+    
+    logger.error(f"Необработанная ошибка: {str(e)}")
+    return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))